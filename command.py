@@ -1,10 +1,275 @@
 import argparse
+import asyncio
+import functools
 import os
-from typing import Callable, Optional, Sequence
+import random
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Callable, Dict, FrozenSet, Iterable, Iterator, List,
+                    Optional, Sequence, Tuple, Type, Union)
 
-from .transform import FilePath, MethodName, RandomizedTransform, Transform
+from .transform import (Arguments, ArgumentsForMethod, ArgumentsList,
+                        BatchTransform, CompiledArguments, Expression,
+                        FilePath, MethodName, RandomizedTransform, Transform,
+                        _METHOD_PARAMS, _MIXED_ORDER, _hw_filters,
+                        _is_constant, compile_arguments, probe_duration)
 
-if __name__ == '__main__':
+
+@functools.lru_cache(maxsize=None)
+def _available_filters() -> FrozenSet[str]:
+    output = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-filters'],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ).stdout.decode()
+    # 形如 " TSC hflip             V->V       Horizontally flip the input video."
+    return frozenset(
+        parts[1] for parts in map(str.split, output.splitlines()) if len(parts) >= 3 and '->' in parts[2]
+    )
+
+
+def _try_probe_duration(input: FilePath):
+    try:
+        probe_duration(input)
+    except Exception:
+        # 图片等没有时长的输入，留到 Transform.duration 真正用到时再报错
+        pass
+
+
+# 依次调用的变换方法及返回其参数的函数
+Plan = Sequence[Tuple[Callable[..., Transform], Callable[..., Arguments]]]
+
+# 参数固定时，每个 ffmpeg 进程最多合并处理的输入数
+_BATCH_SIZE = 32
+
+
+def _apply(transform: Transform, plan: Plan):
+    for method, argument in plan:
+        # 与 mixed 一致，参数为列表时（如多张水印图片）随机选取一个
+        method(transform, **argument(transform._rng))
+
+
+def _generate_cmd(input: FilePath, output: FilePath, cls: Type[Transform], plan: Plan, mixed_args: Optional[Tuple[CompiledArguments, Sequence[MethodName], int]], threads: int, input_seed: Optional[int]) -> List[str]:
+    # 使用以各自种子初始化的随机数生成器，不再为每个输入重新设置模块级生成器的种子
+    transform = cls(input, None if input_seed is None else random.Random(input_seed))
+    if mixed_args is not None:
+        transform.mixed(*mixed_args)
+    _apply(transform, plan)
+    return transform.generate_cmd(output, threads=threads, filter_threads=threads)
+
+
+def _generate_batch_cmd(inputs: Sequence[FilePath], outputs: Sequence[FilePath], cls: Type[Transform], plan: Plan, threads: int) -> List[str]:
+    transforms = [cls(input) for input in inputs]
+    for method, argument in plan:
+        kwargs = dict(argument())
+        if method is cls.watermark:
+            # 水印只处理一次，再 split 给同一进程中的每个输入
+            prepared = {
+                name: kwargs.pop(name) for name in ('image', 'alpha', 'scale', 'angle') if name in kwargs
+            }
+            streams = cls.shared_watermark(count=len(transforms), **prepared)
+            for transform, stream in zip(transforms, streams):
+                method(transform, stream, **kwargs)
+        else:
+            for transform in transforms:
+                method(transform, **kwargs)
+    # 编码线程由各输出平分，滤镜图只有一个，使用全部线程
+    return cls.generate_batch_cmd(transforms, outputs, threads=max(1, threads // len(transforms)), filter_threads=threads)
+
+
+async def _run_all(generators: Iterable[Callable[[], List[str]]], jobs: int):
+    # 同时最多运行 jobs 个 ffmpeg，其余的排队等待
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run(generate_cmd: Callable[[], List[str]]):
+        async with semaphore:
+            # 拿到名额后才构建命令，一个 ffmpeg 运行时可以同时构建下一个命令
+            cmd = generate_cmd()
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            returncode = await process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    await asyncio.gather(*map(run, generators))
+
+
+def _resolve_files(input: Iterable[FilePath]) -> Iterator[FilePath]:
+    folders: List[FilePath] = []
+    for file in input:
+        assert os.path.exists(file), 'invalid path: {}'.format(file)
+        if os.path.isdir(file):
+            folders.append(file)
+        else:
+            yield file
+    # 用栈代替递归，os.scandir 返回的 DirEntry 自带文件类型，不需要再逐个 stat
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                # 不跟随指向文件夹的符号链接，避免出现环
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+
+def _copy_arguments(arguments: Union[Arguments, ArgumentsList, Callable[[], Arguments]]) -> Union[Arguments, ArgumentsList, Callable[[], Arguments]]:
+    if isinstance(arguments, dict):
+        return dict(arguments)
+    elif callable(arguments):
+        return arguments
+    return [dict(argument) for argument in arguments]
+
+
+def _resolve_watermark(arguments: Arguments):
+    # 将水印图片中的文件夹展开为其中的文件，只有一张图片时不再需要随机选取
+    image = arguments.get('image')
+    assert image is not None, 'should specify watermark image'
+    images = list(_resolve_files(
+        [image] if isinstance(image, str) else image))
+    assert len(images) > 0, 'should supply at least 1 watermark image'
+    arguments['image'] = images[0] if len(images) == 1 else images
+
+
+def run(inputs: Sequence[FilePath], methods: Sequence[MethodName] = Transform.methods, arguments: ArgumentsForMethod = {}, randomize: bool = False, mixed: bool = False, mixed_k: int = 3, output_folder: Optional[FilePath] = None, jobs: Optional[int] = None, random_seed: Optional[int] = None):
+    """
+    变换输入文件，与命令行功能相同，但不经过 argparse，适合在脚本中反复调用
+
+    :param inputs: 输入文件或包含输入文件的文件夹
+    :param methods: 变换方法，未启用混合时按顺序应用
+    :param arguments: 各变换方法的参数，键为方法名，参数为列表时随机选取一个；未指定的参数使用方法自身的默认值
+    :param randomize: 是否使用随机参数
+    :param mixed: 是否对每个输入从 methods 中随机选取 mixed_k 个变换方法，选出的方法按固定顺序应用
+    :param mixed_k: 启用混合时每个输入应用的变换方法数
+    :param output_folder: 输出文件夹，为 None 时在输入文件旁保存为 name_transformed.suffix
+    :param jobs: 同时运行的 ffmpeg 进程数，为 None 时为 CPU 核心数
+    :param random_seed: 随机种子，使随机及混合的结果可以复现
+    """
+    # 提前检查，而不是让每个 ffmpeg 进程都启动后才在解析滤镜时失败
+    missing_filters = _hw_filters(Transform.ACCEL) - _available_filters()
+    assert not missing_filters, 'ffmpeg does not support filter(s): {}'.format(
+        ', '.join(sorted(missing_filters)))
+
+    inputs = list(_resolve_files(inputs))
+    assert len(inputs) > 0, 'should have at least one input'
+
+    def output_original_folder(input: FilePath) -> FilePath:
+        return '_transformed'.join(os.path.splitext(input))
+
+    def output_static_folder(input: FilePath) -> FilePath:
+        return os.path.join(output_folder, os.path.basename(input))
+
+    assign_output: Callable[[
+        FilePath], FilePath] = output_static_folder if output_folder else output_original_folder
+
+    outputs = [assign_output(input) for input in inputs]
+    # 指定输出文件夹时，不同文件夹中的同名输入会互相覆盖
+    assert len(set(outputs)) == len(outputs), 'should not have inputs with the same output path'
+
+    assert len(methods) > 0, 'should apply at least 1 transform method'
+    for method in methods:
+        assert method in _METHOD_PARAMS, 'unknown transform method: {}'.format(method)
+
+    cls = RandomizedTransform if randomize else Transform
+
+    # 复制一份，避免修改调用者传入的参数；自定义随机的函数每次调用都返回新的参数，原样保留
+    arguments = {method: _copy_arguments(arguments.get(method, {})) for method in methods}
+
+    if 'watermark' in arguments:
+        watermark = arguments['watermark']
+        if isinstance(watermark, dict):
+            _resolve_watermark(watermark)
+        elif not callable(watermark):
+            for argument in watermark:
+                _resolve_watermark(argument)
+
+    # 只解析一次参数与要调用的方法，而不是对每个输入都重新判断
+    compiled = compile_arguments(arguments)
+    if mixed:
+        plan: Plan = []
+        mixed_args = (compiled, methods, mixed_k)
+    else:
+        plan = [(cls._METHOD_FN[method], compiled[method])
+                for method in methods]
+        mixed_args = None
+
+    # 参数固定时每个输入的变换链都相同，可以合并到同一个 ffmpeg 进程中执行
+    # 有参数需要随机选取（如多张水印图片）时每个输入的变换链不再相同
+    batched = not randomize and not mixed and all(
+        isinstance(argument, dict) and all(map(_is_constant, argument.values())) for argument in arguments.values())
+    if batched:
+        # 按扩展名分批，同一批次的输入与输出格式都相同，模板的占位路径才能保留扩展名，用于判断能否直接复制音视频
+        by_format: Dict[Tuple[str, str], Tuple[List[FilePath], List[FilePath]]] = {}
+        for input, output in zip(inputs, outputs):
+            batch = by_format.setdefault(
+                (os.path.splitext(input)[1], os.path.splitext(output)[1]), ([], []))
+            batch[0].append(input)
+            batch[1].append(output)
+        batches = [
+            (batch_inputs[i:i + _BATCH_SIZE], batch_outputs[i:i + _BATCH_SIZE]) for batch_inputs, batch_outputs in by_format.values() for i in range(0, len(batch_inputs), _BATCH_SIZE)
+        ]
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    assert jobs > 0, 'should run at least 1 job at the same time'
+    jobs = min(len(batches) if batched else len(inputs), jobs)
+    # 平分 CPU 核心，避免多个 ffmpeg 进程各自开满线程
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+
+    if batched and 'duration' not in arguments:
+        # 各批次的滤镜图完全相同，按批次大小与输入输出的扩展名各构建一次模板即可，duration 依赖各输入的时长因此除外
+        templates: Dict[Tuple[int, str, str], BatchTransform] = {}
+
+        def generate_from_template(inputs: Sequence[FilePath], outputs: Sequence[FilePath]) -> List[str]:
+            key = (len(inputs), os.path.splitext(inputs[0])[1], os.path.splitext(outputs[0])[1])
+            if key not in templates:
+                templates[key] = BatchTransform(functools.partial(
+                    _generate_batch_cmd, cls=cls, plan=plan, threads=threads), *key)
+            return templates[key].generate_cmd(inputs, outputs)
+
+        generators = [
+            functools.partial(generate_from_template, batch_inputs, batch_outputs) for batch_inputs, batch_outputs in batches
+        ]
+    elif batched:
+        generators = [
+            functools.partial(_generate_batch_cmd, batch_inputs, batch_outputs, cls, plan, threads) for batch_inputs, batch_outputs in batches
+        ]
+    else:
+        # 为每个输入单独生成种子，使结果与执行顺序无关
+        if random_seed is None:
+            seeds: Sequence[Optional[int]] = [None] * len(inputs)
+        else:
+            rng = random.Random(random_seed)
+            seeds = [rng.getrandbits(64) for _ in inputs]
+        generators = [
+            functools.partial(_generate_cmd, input, output, cls, plan, mixed_args, threads, input_seed) for input, output, input_seed in zip(inputs, outputs, seeds)
+        ]
+
+    if 'duration' in arguments:
+        # 提前并行获取全部时长，避免在构建命令时串行地调用 ffprobe
+        # ffprobe 大部分时间在等待磁盘 I/O，线程数可以多于 CPU 核心数
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            list(executor.map(_try_probe_duration, inputs))
+
+    asyncio.run(_run_all(generators, jobs))
+
+
+def _expression(value: str) -> Expression:
+    # 纯数字的 ffmpeg 表达式转为数值，变换方法才能识别出恒等变换（如 -pt 0）并合并相邻的操作
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _build_parser(methods: Iterable[MethodName] = Transform.methods) -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description='Transform input file(s) with ffmpeg')
 
@@ -17,131 +282,126 @@ if __name__ == '__main__':
                         type=str, nargs='+', help='transform method(s), ordering decides apply order if mixing is not enabled, available methods: {}'.format(' ,'.join(Transform.methods)))
     parser.add_argument('-r', '--randomize', required=False, action='store_true',
                         help='use randomized data instead of default data')
+    parser.add_argument('-s', '--seed', required=False, type=int,
+                        help='random seed, makes randomized and mixed results reproducible')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=os.cpu_count() or 1,
+                        help='how many ffmpeg processes could run at the same time, cpu count for default')
+
+    # 只添加用到的变换方法的选项
+    methods = frozenset(methods)
 
     # 1 watermark
-    watermark = parser.add_argument_group('watermark', 'add watermark')
-    watermark.add_argument('-wi', '--watermark_image', required=False, type=str,
-                           nargs='+', help='watermark image(s) or folder(s) containing watermark image(s)')
-    watermark.add_argument('-wa', '--watermark_alpha', required=False, type=float,
-                           help='alpha of watermark, (0, 1], 0 = totally transparent, 1 = totally not transparent')
-    watermark.add_argument('-wx', '--watermark_x', required=False,
-                           type=str, help='x offset of watermark')
-    watermark.add_argument('-wy', '--watermark_y', required=False,
-                           type=str, help='y offset of watermark')
-    watermark.add_argument('-ws', '--watermark_scale', required=False,
-                           type=float, help='scale of watermark, (0, +inf)')
-    watermark.add_argument('-wr', '--watermark_rotate', '--watermark_angle', dest='watermark_angle', required=False,
-                           type=float, help='rotate angle(clockwise) of watermark, [0, 360) in degrees')
+    if 'watermark' in methods:
+        watermark = parser.add_argument_group('watermark', 'add watermark')
+        watermark.add_argument('-wi', '--watermark_image', required=False, type=str,
+                               nargs='+', help='watermark image(s) or folder(s) containing watermark image(s)')
+        watermark.add_argument('-wa', '--watermark_alpha', required=False, type=float,
+                               help='alpha of watermark, (0, 1], 0 = totally transparent, 1 = totally not transparent')
+        watermark.add_argument('-wx', '--watermark_x', required=False,
+                               type=_expression, help='x offset of watermark')
+        watermark.add_argument('-wy', '--watermark_y', required=False,
+                               type=_expression, help='y offset of watermark')
+        watermark.add_argument('-ws', '--watermark_scale', required=False,
+                               type=float, help='scale of watermark, (0, +inf)')
+        watermark.add_argument('-wr', '--watermark_rotate', '--watermark_angle', dest='watermark_angle', required=False,
+                               type=float, help='rotate angle(clockwise) of watermark, [0, 360) in degrees')
 
     # 2 padding
-    padding = parser.add_argument_group('padding', 'add black padding')
-    padding.add_argument('-pt', '--padding_top', required=False,
-                         type=str, help='width of padding top')
-    padding.add_argument('-pr', '--padding_right', required=False,
-                         type=str, help='width of padding right')
-    padding.add_argument('-pb', '--padding_bottom', required=False,
-                         type=str, help='width of padding bottom')
-    padding.add_argument('-pl', '--padding_left', required=False,
-                         type=str, help='width of padding left')
+    if 'padding' in methods:
+        padding = parser.add_argument_group('padding', 'add black padding')
+        padding.add_argument('-pt', '--padding_top', required=False,
+                             type=_expression, help='width of padding top')
+        padding.add_argument('-pr', '--padding_right', required=False,
+                             type=_expression, help='width of padding right')
+        padding.add_argument('-pb', '--padding_bottom', required=False,
+                             type=_expression, help='width of padding bottom')
+        padding.add_argument('-pl', '--padding_left', required=False,
+                             type=_expression, help='width of padding left')
 
     # 3 duration
-    duration = parser.add_argument_group(
-        'duration', 'change duration by ratio')
-    duration.add_argument('-ds', '--duration_start_ratio', required=False,
-                          type=float, help='start ratio of duration, (0, 1)')
-    duration.add_argument('-dr', '--duration_ratio', required=False,
-                          type=float, help='ratio of duration, (0, 1)')
+    if 'duration' in methods:
+        duration = parser.add_argument_group(
+            'duration', 'change duration by ratio')
+        duration.add_argument('-ds', '--duration_start_ratio', required=False,
+                              type=float, help='start ratio of duration, (0, 1)')
+        duration.add_argument('-dr', '--duration_ratio', required=False,
+                              type=float, help='ratio of duration, (0, 1)')
 
     # 4 scale
-    scale = parser.add_argument_group('scale', 'scale by ratio')
-    scale.add_argument('-sr', '--scale_ratio', required=False,
-                       type=float, help='ratio of scale, (0, +inf)')
+    if 'scale' in methods:
+        scale = parser.add_argument_group('scale', 'scale by ratio')
+        scale.add_argument('-sr', '--scale_ratio', required=False,
+                           type=float, help='ratio of scale, (0, +inf)')
 
     # 5 mirror
-    mirror = parser.add_argument_group(
-        'mirror', 'mirroring horizontally, no option available')
+    if 'mirror' in methods:
+        parser.add_argument_group(
+            'mirror', 'mirroring horizontally, no option available')
 
     # 6 rotate
-    rotate = parser.add_argument_group('rotate', 'rotate the input clockwise')
-    rotate.add_argument('-ra', '--rotate_angle', required=False, type=float,
-                        help='rotate angle(clockwise) of input, [0, 360) in degrees')
+    if 'rotate' in methods:
+        rotate = parser.add_argument_group(
+            'rotate', 'rotate the input clockwise')
+        rotate.add_argument('-ra', '--rotate_angle', required=False, type=float,
+                            help='rotate angle(clockwise) of input, [0, 360) in degrees')
 
     # 7 brightness
-    brightness = parser.add_argument_group('brightness', 'change brightness')
-    brightness.add_argument('-b', '--brightness', metavar='BRIGHTNESS', dest='brightness_brightness', required=False,
-                            type=float, help='brightness value')
+    if 'brightness' in methods:
+        brightness = parser.add_argument_group(
+            'brightness', 'change brightness')
+        brightness.add_argument('-b', '--brightness', metavar='BRIGHTNESS', dest='brightness_brightness', required=False,
+                                type=float, help='brightness value')
 
     # 8 crop
-    crop = parser.add_argument_group('crop', 'crop the input')
-    crop.add_argument('-cw', '--crop_width', '--crop_w', dest='crop_w', required=False,
-                      type=str, help='width **after** cropping')
-    crop.add_argument('-ch', '--crop_height', '--crop_h', dest='crop_h', required=False,
-                      type=str, help='height **after** cropping')
-    crop.add_argument('-cx', '--crop_x', required=False,
-                      type=str, help='x offset of cropping')
-    crop.add_argument('-cy', '--crop_y', required=False,
-                      type=str, help='y offset of cropping')
+    if 'crop' in methods:
+        crop = parser.add_argument_group('crop', 'crop the input')
+        crop.add_argument('-cw', '--crop_width', '--crop_w', dest='crop_w', required=False,
+                          type=_expression, help='width **after** cropping')
+        crop.add_argument('-ch', '--crop_height', '--crop_h', dest='crop_h', required=False,
+                          type=_expression, help='height **after** cropping')
+        crop.add_argument('-cx', '--crop_x', required=False,
+                          type=_expression, help='x offset of cropping')
+        crop.add_argument('-cy', '--crop_y', required=False,
+                          type=_expression, help='y offset of cropping')
 
     # 9 mixed
     mixed = parser.add_argument_group(
         'mixed', 'mix the transform method(s) randomly')
     mixed.add_argument('-m', '--mixed', required=False, action='store_true',
-                       help='enable mixing, that would shuffle all the methods in --function')
+                       help='enable mixing, that would randomly pick --mixed_k of the methods in --function for each input and apply them in a fixed order: {}'.format(', '.join(_MIXED_ORDER)))
     mixed.add_argument('-mk', '--mixed_k', required=False, type=int, default=3,
                        help='how many transform method(s) should be applied per input, 3 for default')
 
-    args = parser.parse_args()
-
-    def resolve_files(input: Sequence[FilePath]) -> Sequence[FilePath]:
-        files: Sequence[FilePath] = []
-        for file in input:
-            assert os.path.exists(file), 'invalid path: {}'.format(file)
-            if os.path.isdir(file):
-                files += resolve_files(os.listdir(file))
-            else:
-                files.append(file)
-        return files
-
-    inputs = resolve_files(args.input)
-    assert len(inputs) > 0, 'should have at least one input'
-
-    def output_original_folder(input: FilePath) -> FilePath:
-        return '_transformed'.join(os.path.splitext(input))
+    return parser
 
-    def output_static_folder(input: FilePath) -> FilePath:
-        return os.path.join(args.output_folder, os.path.basename(input))
 
-    assign_output: Callable[[
-        FilePath], FilePath] = output_static_folder if args.output_folder else output_original_folder
+def main():
+    # 先只解析 --function，再添加对应变换方法的选项
+    # 未指定 --function 时（混合全部方法或查看帮助）添加全部选项
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument('-f', '--function', type=str, nargs='+')
+    known, _ = base_parser.parse_known_args()
+    args = _build_parser(known.function or Transform.methods).parse_args()
 
     assert args.function or args.mixed, 'should apply at least 1 transform method'
 
     transform_methods: Sequence[MethodName] = args.function or Transform.methods
-
-    cls = RandomizedTransform if args.randomize else Transform
+    for method in transform_methods:
+        assert method in _METHOD_PARAMS, 'unknown transform method: {}'.format(method)
 
     arguments = {}
     for method in transform_methods:
         argument = {}
         arguments[method] = argument
-        for var_name in getattr(cls, method).__code__.co_varnames:
-            if var_name != 'self':
-                option_name = '_'.join((method, var_name))
-                if hasattr(args, option_name):
-                    argument[var_name] = getattr(args, option_name)
+        for var_name in _METHOD_PARAMS[method]:
+            # 未指定的选项为 None，不传入以使用方法自身的默认值
+            value = getattr(args, '_'.join((method, var_name)), None)
+            if value is not None:
+                argument[var_name] = value
 
-    if 'watermark' in arguments:
-        image: Optional[Sequence[FilePath]] = args.watermark_image
-        assert image is not None, 'should specify watermark image'
-        images = resolve_files(image)
-        assert len(images) > 0, 'should supply at least 1 watermark image'
-        arguments['watermark']['image'] = images
-
-    for input in inputs:
-        transform = cls(input)
-        if args.mixed:
-            transform.mixed(arguments, transform_methods, args.mixed_k)
-        else:
-            for method in transform_methods:
-                getattr(transform, method)(**arguments['method'])
-        transform.run(assign_output(input))
+    run(args.input, transform_methods, arguments, randomize=args.randomize, mixed=args.mixed, mixed_k=args.mixed_k,
+        output_folder=args.output_folder, jobs=args.jobs, random_seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
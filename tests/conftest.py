@@ -0,0 +1,11 @@
+import importlib.util
+import os
+import sys
+
+# 仓库根目录本身就是包（模块之间使用相对导入），以固定的包名导入，不依赖仓库所在的目录名
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    'videotransform', os.path.join(_ROOT, '__init__.py'), submodule_search_locations=[_ROOT])
+_package = importlib.util.module_from_spec(_spec)
+sys.modules['videotransform'] = _package
+_spec.loader.exec_module(_package)
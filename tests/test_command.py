@@ -0,0 +1,11 @@
+from videotransform.command import _build_parser
+from videotransform.transform import Transform
+
+
+def test_numeric_cli_expressions_hit_identity_guards():
+    args = _build_parser(['padding', 'crop']).parse_args(
+        ['a.mp4', '-pt', '0', '-pr', '0', '-pb', '0', '-pl', '0', '-cx', '0', '-cy', '0.0', '-cw', 'iw'])
+    transform = Transform('a.mp4')
+    transform.padding(args.padding_top, args.padding_right, args.padding_bottom, args.padding_left)
+    transform.crop(w=args.crop_w, x=args.crop_x, y=args.crop_y)
+    assert '-filter_complex' not in transform.generate_cmd('x.mp4')
@@ -0,0 +1,77 @@
+import random
+import subprocess
+from typing import Dict, List
+
+from videotransform.transform import (BatchTransform, Transform,
+                                      _compile_arguments, choice)
+
+
+def _output_maps(cmd: List[str], outputs: List[str]) -> Dict[str, List[str]]:
+    # 每个输出文件之前（上一个输出之后）的 -map 参数
+    maps: Dict[str, List[str]] = {}
+    current: List[str] = []
+    for i, arg in enumerate(cmd):
+        if arg in outputs:
+            maps[arg] = current
+            current = []
+        elif i > 0 and cmd[i - 1] == '-map':
+            current.append(arg)
+    return maps
+
+
+def test_batch_maps_every_output_to_its_own_input():
+    outputs = ['x.mp4', 'y.mp4', 'z.mkv']
+    cmd = Transform.generate_batch_cmd(
+        [Transform('a.mp4'), Transform('b.mp4').scale(0.5), Transform('c.mp4')], outputs)
+    maps = _output_maps(cmd, outputs)
+    assert maps['x.mp4'] == ['0:v', '0:a?']
+    assert maps['y.mp4'][1:] == ['1:a?']
+    assert maps['z.mkv'] == ['2:v', '2:a?']
+
+
+def test_single_output_keeps_default_stream_selection():
+    assert '-map' not in Transform('a.mp4').generate_cmd('x.mp4')
+
+
+def test_batch_template_keeps_extensions_for_stream_copy():
+    template = BatchTransform(lambda inputs, outputs: Transform.generate_batch_cmd(
+        [Transform(inputs[0]).scale(0.5)], outputs), 1, '.mp4', '.mp4')
+    cmd = template.generate_cmd(['a.mp4'], ['x.mp4'])
+    assert cmd[cmd.index('-acodec') + 1] == 'copy'
+    assert 'a.mp4' in cmd and 'x.mp4' in cmd
+
+
+class _Name(str):
+    pass
+
+
+def test_compiled_arguments_treat_values_like_choice():
+    values = [_Name('left'), 'right', 1, 0.5, None, ['a', 'b'], ('c',), lambda: 'called']
+    arguments = {str(i): value for i, value in enumerate(values)}
+    compiled = _compile_arguments(arguments)(random.Random(0))
+    rng = random.Random(0)
+    assert compiled == {str(i): choice(value, rng) for i, value in enumerate(values)}
+    assert compiled['0'] == 'left'
+
+
+class _FakePopen(object):
+    commands: List[List[str]] = []
+
+    def __init__(self, cmd, **kwargs):
+        self.args = cmd
+        _FakePopen.commands.append(cmd)
+
+    def wait(self):
+        return 0
+
+
+def test_run_batch_group_with_simplified_away_transform(monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', _FakePopen)
+    _FakePopen.commands = []
+    outputs = ['x.mp4', 'y.mp4']
+    # 两次缩放相互抵消，两个变换都没有滤镜，会被分到同一组
+    jobs = [(Transform('a.mp4').scale(2).scale(0.5), outputs[0]), (Transform('b.mp4'), outputs[1])]
+    Transform.run_batch(jobs, max_workers=1, group_size=2)
+    assert len(_FakePopen.commands) == 1
+    maps = _output_maps(_FakePopen.commands[0], outputs)
+    assert maps == {'x.mp4': ['0:v', '0:a?'], 'y.mp4': ['1:v', '1:a?']}
@@ -3,13 +3,25 @@
 from __future__ import annotations
 # python >= 3.7.0b1 才可使用，python >= 3.10 开始不再需要 import，如果你的 python 版本不够，尝试注释掉该条 import 语句并删除带有 Transform 字样的类型标注或是将其改为字符串 'Transform' 即可让其运行起来
 
+import atexit
+import inspect
+import json
+import os
 import random
 import subprocess
-from typing import (Callable, Dict, List, Optional, Sequence, Tuple, TypeVar,
-                    Union)
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Callable, Dict, FrozenSet, List, Optional, Sequence,
+                    Tuple, TypeVar, Union)
 import ffmpeg
 import math
 
+try:
+    # 可选依赖，解析 ffprobe 的输出与时长缓存时比标准库更快
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 # ffmpeg 表达式
 Expression = Union[int, float, str]
 # 文件的路径
@@ -36,35 +48,544 @@ ArgumentsForMethod = Dict[MethodName, Union[Arguments,
                                             ArgumentsList, Callable[[], Arguments]]]
 
 
+# 本模块会用到的 ffmpeg 滤镜
+_FILTERS: FrozenSet[str] = frozenset((
+    'colorchannelmixer',
+    'crop',
+    'eq',
+    'format',
+    'hflip',
+    'overlay',
+    'pad',
+    'rotate',
+    'scale',
+    'split',
+    'transpose',
+    'vflip',
+))
+
+# 设置了 Transform.ACCEL 时额外用到的滤镜，需要 ffmpeg 编译时支持对应的硬件加速，因此不放在 _FILTERS 中
+_HW_FILTERS: FrozenSet[str] = frozenset((
+    'hwdownload',
+    'hwupload',
+    'scale_cuda',
+    'scale_vaapi',
+))
+
+
+# mixed 中各变换的应用顺序，保持分辨率的变换在前，会增大分辨率的变换在后，减小中间帧的大小
+_MIXED_ORDER: Tuple[MethodName, ...] = (
+    'brightness',
+    'mirror',
+    'crop',
+    'scale',
+    'rotate',
+    'padding',
+    'watermark',
+    'duration',
+)
+_MIXED_PRIORITY: Dict[MethodName, int] = {
+    method: i for i, method in enumerate(_MIXED_ORDER)
+}
+
+
 T = TypeVar('T')
 # 单个值、从序列中随机选一个值、使用自定义函数手动选取一个值
 Chooseable = Union[T, Sequence[T], Callable[[], T]]
 
 
-def choice(arg: Chooseable[T]) -> T:
-    if isinstance(arg, Sequence) and not isinstance(arg, str):
-        return random.choice(arg)
-    elif callable(arg):
+# 本模块所有随机数的来源，可以通过 seed() 使结果可复现
+_rng = random.Random()
+if hasattr(os, 'register_at_fork'):
+    # 与 random 模块自身一样，fork 出的子进程需要重新播种，否则各进程会得到相同的随机序列
+    os.register_at_fork(after_in_child=_rng.seed)
+
+
+def seed(a: Optional[Union[int, float, str, bytes]] = None):
+    """
+    设置本模块的随机数种子，用于复现随机变换的结果
+
+    :param a: 种子，参考 random.seed()
+    """
+    _rng.seed(a)
+
+
+# 最常见的参数类型，可以直接返回而不必经过 ABC 的 isinstance 检查
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _is_constant(arg: Chooseable[T]) -> bool:
+    # choice() 直接返回自身的参数视为常量，choice() 与 compile_arguments() 共用此判断，结果才能一致
+    # 字符串（包括 str 的子类）虽然是 Sequence 但总是作为单个参数
+    return type(arg) in _SCALAR_TYPES or isinstance(arg, str) or not (isinstance(arg, Sequence) or callable(arg))
+
+
+def choice(arg: Chooseable[T], rng: random.Random = _rng) -> T:
+    # 最常见的类型先按确切类型判断，结果与 _is_constant() 相同
+    arg_type = type(arg)
+    if arg_type in _SCALAR_TYPES:
+        return arg
+    elif arg_type is list or arg_type is tuple:
+        return rng.choice(arg)
+    elif _is_constant(arg):
+        return arg
+    elif isinstance(arg, Sequence):
+        return rng.choice(arg)
+    else:
         return arg()
+
+
+def _compile_choice(arg: Chooseable[T]) -> Callable[[random.Random], T]:
+    if isinstance(arg, Sequence):
+        return lambda rng: rng.choice(arg)
     else:
-        return arg
+        return lambda rng: arg()
+
+
+def _compile_arguments(arguments: Chooseable[Arguments]) -> Callable[..., Arguments]:
+    # 消耗随机数的顺序与 choice() 逐个选取时一致，同一种子下结果不变
+    if isinstance(arguments, Sequence):
+        alternatives = [_compile_arguments(argument) for argument in arguments]
+        return lambda rng=_rng: rng.choice(alternatives)(rng)
+    elif callable(arguments):
+        return lambda rng=_rng: {
+            name: choice(argument, rng) for name, argument in arguments().items()
+        }
+    constant = {
+        name: argument for name, argument in arguments.items() if _is_constant(argument)
+    }
+    dynamic = [
+        (name, _compile_choice(argument)) for name, argument in arguments.items() if not _is_constant(argument)
+    ]
+    if not dynamic:
+        return lambda rng=_rng: constant
+
+    def compiled(rng: random.Random = _rng) -> Arguments:
+        kwargs = dict(constant)
+        for name, get in dynamic:
+            kwargs[name] = get(rng)
+        return kwargs
+    return compiled
+
+
+class CompiledArguments(dict):
+    """
+    compile_arguments() 的返回值，键为变换方法名，值为每次调用时返回一组参数的函数，可以传入使用的随机数生成器
+    """
+    __slots__ = ()
+
+
+def compile_arguments(args: ArgumentsForMethod) -> CompiledArguments:
+    """
+    预先解析 mixed() 的参数，之后每次调用都不再需要逐个判断参数的类型，适合对大量输入使用同一组参数的情况
+
+    :param args: 各变换方法的参数，参考 mixed()
+    :returns: 可以代替 args 传入 mixed() 的已解析参数
+    """
+    return CompiledArguments(
+        (method, _compile_arguments(arguments)) for method, arguments in args.items()
+    )
+
+
+# 视频时长的缓存，键为文件的绝对路径
+_duration_cache: Dict[FilePath, float] = {}
+
+# 视频时长的磁盘缓存，键为文件的绝对路径，值为 [修改时间, 大小, 时长]，文件未变化时多次运行之间无需重复调用 ffprobe
+_DURATION_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'),
+    'videotransformffmpeg',
+    'durations.json',
+)
+_disk_cache: Optional[Dict[FilePath, List[Union[int, float]]]] = None
+_disk_cache_lock = threading.Lock()
+
+
+def _load_cache() -> Dict[FilePath, List[Union[int, float]]]:
+    global _disk_cache
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            try:
+                with open(_DURATION_CACHE_FILE, 'rb') as file:
+                    _disk_cache = _json_loads(file.read())
+            except (OSError, ValueError):
+                _disk_cache = {}
+            atexit.register(_save_cache, dict(_disk_cache))
+        return _disk_cache
+
+
+def _save_cache(loaded: Dict[FilePath, List[Union[int, float]]]):
+    if _disk_cache == loaded:
+        return
+    try:
+        os.makedirs(os.path.dirname(_DURATION_CACHE_FILE), exist_ok=True)
+        # 先写入临时文件再替换，避免多个进程同时写入时损坏缓存
+        temp = f'{_DURATION_CACHE_FILE}.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            json.dump(_disk_cache, file)
+        os.replace(temp, _DURATION_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _ffprobe_duration(filename: FilePath) -> float:
+    # 只输出需要的字段且不带任何结构，直接按行解析，而不是像 ffmpeg.probe 那样输出并解析全部流的 JSON
+    output = subprocess.run(
+        [
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'format=duration:stream=duration',
+            '-of', 'csv=p=0',
+            filename,
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ).stdout.split()
+    # 视频流（如果有）的时长在前，整体时长总在最后一行
+    # 部分容器没有整体时长，此时退回到视频流的时长
+    for duration in reversed(output):
+        if duration != b'N/A':
+            return float(duration)
+    raise ValueError(f'cannot get duration of {filename}')
+
+
+# 以绝对路径为键缓存 probe() 的完整结果
+_probe_cache: Dict[FilePath, dict] = {}
+
+
+def probe(filename: FilePath) -> dict:
+    """
+    通过 ffprobe 一次性获取视频/图片的容器与全部流的信息，结果会被缓存到内存中，之后的 probe_duration 也会直接使用该结果
+
+    :param filename: 视频/图片路径
+    :returns: ffprobe 输出的 JSON，包含 format 与 streams
+    :raises CalledProcessError
+    """
+    key = os.path.abspath(filename)
+    info = _probe_cache.get(key)
+    if info is None:
+        info = _probe_cache[key] = _json_loads(subprocess.run(
+            [
+                'ffprobe', '-v', 'error',
+                '-print_format', 'json',
+                '-show_format',
+                '-show_streams',
+                filename,
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ).stdout)
+    return info
+
+
+def _info_duration(info: dict) -> Optional[float]:
+    # 部分容器没有整体时长，此时退回到第一个视频流的时长
+    durations = [info.get('format', {}).get('duration')]
+    durations += [
+        stream.get('duration') for stream in info.get('streams', ()) if stream.get('codec_type') == 'video'
+    ][:1]
+    for duration in durations:
+        if duration is not None and duration != 'N/A':
+            return float(duration)
+    return None
+
+
+def cache_durations(durations: Dict[FilePath, float]):
+    """
+    传入已知的视频时长，之后对这些视频调用 probe_duration 或 duration 时不再调用 ffprobe，适合已经在别处保存了视频信息的情况
+
+    :param durations: 视频路径到视频时长（秒）的映射
+    """
+    for filename, duration in durations.items():
+        _duration_cache[os.path.abspath(filename)] = float(duration)
+
+
+def probe_duration(filename: FilePath) -> float:
+    """
+    通过 ffprobe 获取视频时长，结果会被缓存到内存与磁盘中，因此可以提前在多个线程中批量调用
+
+    :param filename: 视频路径
+    :returns: 视频时长，单位为秒
+    """
+    key = os.path.abspath(filename)
+    if key not in _duration_cache:
+        stat = os.stat(key)
+        disk_cache = _load_cache()
+        cached = disk_cache.get(key)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            duration = float(cached[2])
+        else:
+            # 已经通过 probe() 获取过完整信息时直接使用，不再调用 ffprobe
+            info = _probe_cache.get(key)
+            duration = _info_duration(info) if info is not None else None
+            if duration is None:
+                duration = _ffprobe_duration(filename)
+            disk_cache[key] = [stat.st_mtime_ns, stat.st_size, duration]
+        _duration_cache[key] = duration
+    return _duration_cache[key]
+
+
+# 旋转直角时使用的滤镜，不需要插值与填充，比 rotate 滤镜快得多
+# 180 度使用水平与竖直翻转，各只需一次逐行拷贝，比两次 transpose 少一半内存访问
+_RIGHT_ANGLE_FILTERS: Dict[float, Tuple[Tuple[str, ...], ...]] = {
+    0: (),
+    90: (('transpose', '1'),),
+    180: (('hflip',), ('vflip',)),
+    270: (('transpose', '2'),),
+}
+
+
+def _file_parameters(file: FileDesc) -> FileParameters:
+    return file if isinstance(file, dict) else {
+        'filename': file,
+    }
+
+
+# 以下几个函数直接在流上添加滤镜，供 Transform 的同名方法与水印图像的处理共用
+
+def _scale(stream: ffmpeg.Stream, ratio: float) -> ffmpeg.Stream:
+    if ratio == 1.0:
+        return stream
+    # 为什么只能是偶数？
+    return ffmpeg.filter(
+        stream,
+        'scale',
+        f'round(iw*{ratio}/2)*2',
+        f'round(ih*{ratio}/2)*2',
+    )
+
+
+def _rotate(stream: ffmpeg.Stream, angle: float) -> ffmpeg.Stream:
+    angle %= 360
+    filters = _RIGHT_ANGLE_FILTERS.get(angle)
+    if filters is not None:
+        for args in filters:
+            stream = ffmpeg.filter(stream, *args)
+        return stream
+    radian = math.radians(angle)
+    abssin = abs(math.sin(radian))
+    abscos = abs(math.cos(radian))
+    return ffmpeg.filter(
+        stream,
+        'rotate',
+        f'{angle}*PI/180',
+        f'iw*{abscos}+ih*{abssin}',
+        f'iw*{abssin}+ih*{abscos}',
+        fillcolor='none',
+    )
+
+
+def _padding(stream: ffmpeg.Stream, top: Expression, right: Expression, bottom: Expression, left: Expression) -> ffmpeg.Stream:
+    # http://trac.ffmpeg.org/ticket/1618
+    return ffmpeg.filter(
+        stream,
+        'pad',
+        f'ceil((iw+x+{right})/2)*2',
+        f'ceil((ih+y+{bottom})/2)*2',
+        f'round({left})',
+        f'round({top})',
+    )
+
+
+def _alpha(stream: ffmpeg.Stream, alpha: float) -> ffmpeg.Stream:
+    if alpha == 1.0:
+        return stream
+    return ffmpeg.filter(ffmpeg.filter(stream, 'format', 'rgba'), 'colorchannelmixer', aa=alpha)
+
+
+def _watermark(image: FileDesc, alpha: float, scale: float, angle: float) -> ffmpeg.Stream:
+    # 水印图像只需要依次缩放、旋转、调整透明度，不必为此再构建一个 Transform
+    return _alpha(_rotate(_scale(ffmpeg.input(**_file_parameters(image)), scale), angle), alpha)
+
+
+def _overlay(stream: ffmpeg.Stream, image: Union[FileDesc, ffmpeg.Stream], alpha: float, x: Expression, y: Expression, scale: float, angle: float) -> ffmpeg.Stream:
+    if not isinstance(image, ffmpeg.Stream):
+        image = _watermark(image, alpha, scale, angle)
+    return ffmpeg.overlay(
+        stream,
+        image,
+        x=x,
+        y=y,
+    )
+
+
+# 各硬件加速方式对应的缩放滤镜
+_HW_SCALE_FILTERS: Dict[str, str] = {
+    'cuda': 'scale_cuda',
+    'vaapi': 'scale_vaapi',
+}
+
+
+def _hw_filters(accel: Optional[str]) -> FrozenSet[str]:
+    # 使用该硬件加速方式时需要的全部滤镜
+    if accel is None:
+        return _FILTERS
+    return _FILTERS | {'hwupload', 'hwdownload', _HW_SCALE_FILTERS[accel]}
+
+
+def _hw_scale(stream: ffmpeg.Stream, accel: str, ratio: float) -> ffmpeg.Stream:
+    assert accel in _HW_SCALE_FILTERS, f'unsupported hardware acceleration: {accel}'
+    # 上传到显存缩放后再下载回内存，前后的滤镜不需要支持硬件帧
+    # 显存中统一使用 nv12，下载后仍为 nv12，透明通道与 10 bit 色深会在此丢失
+    stream = ffmpeg.filter(ffmpeg.filter(stream, 'format', 'nv12'), 'hwupload')
+    stream = ffmpeg.filter(
+        stream,
+        _HW_SCALE_FILTERS[accel],
+        f'round(iw*{ratio}/2)*2',
+        f'round(ih*{ratio}/2)*2',
+    )
+    return ffmpeg.filter(ffmpeg.filter(stream, 'hwdownload'), 'format', 'nv12')
+
+
+# 记录的变换操作名到实际添加滤镜的函数，函数的第一个参数为输入流
+_EMITTERS: Dict[str, Callable[..., ffmpeg.Stream]] = {
+    'alpha': _alpha,
+    'filter': ffmpeg.filter,
+    'overlay': _overlay,
+    'padding': _padding,
+    'rotate': _rotate,
+    'scale': _scale,
+}
+
+# 一次变换操作：操作名、位置参数、关键字参数
+Operation = Tuple[str, tuple, Dict[str, object]]
+
+
+# 相邻的直角旋转与水平镜像可以合并为一个 transpose，键为两个操作的顺序与旋转角度
+_ROTATE_MIRROR_FILTERS: Dict[Tuple[bool, float], Tuple[str, ...]] = {
+    # (先旋转, 角度)
+    (True, 90): ('transpose', '0'),
+    (True, 180): ('vflip',),
+    (True, 270): ('transpose', '3'),
+    (False, 90): ('transpose', '3'),
+    (False, 180): ('vflip',),
+    (False, 270): ('transpose', '0'),
+}
+
+# 查表得到的滤镜名都应在 _FILTERS 中，拼错的滤镜名（如 hfilp）在导入时即可发现，而不是等到 ffmpeg 解析滤镜图时才失败
+assert {args[0] for filters in _RIGHT_ANGLE_FILTERS.values() for args in filters} | {
+    args[0] for args in _ROTATE_MIRROR_FILTERS.values()} <= _FILTERS, 'should only use filters listed in _FILTERS'
+assert all(_hw_filters(accel) <= _FILTERS | _HW_FILTERS for accel in _HW_SCALE_FILTERS), \
+    'should only use hardware filters listed in _HW_FILTERS'
+
+
+def _is_filter(op: Operation, *args: str) -> bool:
+    return op[0] == 'filter' and op[1] == args and not op[2]
+
+
+def _merge(first: Operation, second: Operation) -> Optional[Tuple[Operation, ...]]:
+    # 返回代替这两个操作的操作（可以为空），无法合并时返回 None
+    if first[0] == 'scale' and second[0] == 'scale':
+        ratio = first[1][0] * second[1][0]
+        return () if ratio == 1.0 else (('scale', (ratio,), {}),)
+    if first[0] == 'padding' and second[0] == 'padding':
+        # 以 iw / ih 表示的边框宽度依赖上一次填充后的尺寸，只合并固定的像素值
+        if all(type(width) in (int, float) for width in first[1] + second[1]):
+            return (('padding', tuple(a + b for a, b in zip(first[1], second[1])), {}),)
+        return None
+    if first[0] == 'rotate' and second[0] == 'rotate':
+        # 任意角度的旋转会扩大画布并填充透明像素，两次旋转与一次旋转的结果不同，因此只合并直角
+        if first[1][0] in _RIGHT_ANGLE_FILTERS and second[1][0] in _RIGHT_ANGLE_FILTERS:
+            angle = (first[1][0] + second[1][0]) % 360
+            return () if angle == 0 else (('rotate', (angle,), {}),)
+        return None
+    if (_is_filter(first, 'hflip') and _is_filter(second, 'hflip')) or (_is_filter(first, 'vflip') and _is_filter(second, 'vflip')):
+        return ()
+    if first[0] == 'rotate' and _is_filter(second, 'hflip'):
+        args = _ROTATE_MIRROR_FILTERS.get((True, first[1][0]))
+    elif _is_filter(first, 'hflip') and second[0] == 'rotate':
+        args = _ROTATE_MIRROR_FILTERS.get((False, second[1][0]))
+    else:
+        return None
+    return None if args is None else (('filter', args, {}),)
+
+
+def _simplify(ops: List[Operation]) -> List[Operation]:
+    # 窥孔优化：反复合并相邻的操作，减少 ffmpeg 对每一帧的处理次数
+    simplified: List[Operation] = []
+    for op in ops:
+        pending: Optional[Operation] = op
+        while pending is not None and simplified:
+            merged = _merge(simplified[-1], pending)
+            if merged is None:
+                break
+            simplified.pop()
+            pending = merged[0] if merged else None
+        if pending is not None:
+            simplified.append(pending)
+    return simplified
+
+
+# 不能包含音频的输出格式（图片与 GIF）
+_NO_AUDIO_EXTENSIONS: FrozenSet[str] = frozenset((
+    '.apng',
+    '.bmp',
+    '.gif',
+    '.jpeg',
+    '.jpg',
+    '.png',
+    '.tif',
+    '.tiff',
+    '.webp',
+))
+
+
+def _has_audio(output: FilePath) -> bool:
+    return os.path.splitext(output)[1].lower() not in _NO_AUDIO_EXTENSIONS
+
+
+def _same_format(input: FilePath, output: FilePath) -> bool:
+    # 没有扩展名（如 BatchTransform 的占位路径）时无法判断，视为不同
+    extension = os.path.splitext(input)[1].lower()
+    return bool(extension) and extension == os.path.splitext(output)[1].lower()
+
+
+def _skeleton(stream: ffmpeg.Stream) -> Optional[Tuple[str, ...]]:
+    # 滤镜图的结构，只包含各节点的名称而不包含参数，结构相同的变换放在同一进程中时各进程的负载更均衡
+    # 水印等额外输入在不同变换间可能完全相同而被 ffmpeg-python 合并，此时返回 None 表示不能与其它变换合并
+    nodes = ffmpeg.dag.topo_sort([stream.node])[0]
+    if sum(isinstance(node, ffmpeg.nodes.InputNode) for node in nodes) > 1:
+        return None
+    return tuple(node.name for node in nodes)
+
+
+# 缓存命令时代替输出路径的占位符
+_OUTPUT_PLACEHOLDER = '__TEMPLATE_OUTPUT__'
 
 
 class Transform(object):
-    __slots__ = ['input', 'stream', 'now_duration']
+    __slots__ = ['input', '_source', '_stream', '_ops', 'now_duration', '_duration_ratios', '_cmd_cache', '_rng', '_accel']
 
-    def __init__(self, input: FileDesc):
+    # 硬件加速，None 为不使用，'cuda' / 'vaapi' 时缩放在 GPU 上执行，其余滤镜仍在 CPU 上执行
+    # 可以通过继承或直接修改 Transform.ACCEL 设置，只影响之后构建的滤镜图
+    ACCEL: Optional[str] = None
+
+    def __init__(self, input: FileDesc, rng: Optional[random.Random] = None):
         """
         初始化视频/图片变换类
 
         :param input: 要处理的视频/图片，注意本类中输入的视频/图片路径可能不会被实际确认是否存在
-        :param _parent: 内部参数，不需要也不应手动传入
+        :param rng: mixed() 及随机参数使用的随机数生成器，默认使用受 seed() 控制的模块级生成器
         """
-        self.input = self.__get_file_parameters(input)
-        self.stream: ffmpeg.Stream = self.__input(self.input)
+        self._stream: ffmpeg.Stream = ffmpeg.input(**_file_parameters(input))
+        # 输入本身，用于选取音频流以及判断是否添加了滤镜
+        self._source = self._stream
+        # 变换方法只记录操作，直到真正需要滤镜图时才构建，被丢弃的变换不会产生任何开销
+        self._ops: List[Operation] = []
+        # 与输入节点共用同一个参数字典，generate_cmd 中设置的 -ss / -t 才会真正作用于输入
+        self.input = self._stream.node.kwargs
         self.now_duration: Optional[Tuple[float, float]] = None
+        # 尚未获取视频时长时，以 (开始比例, 保留比例) 记录要保留的片段，直到生成命令时才获取时长
+        self._duration_ratios: Optional[Tuple[float, float]] = None
+        # (滤镜图, 其余参数, 以占位符为输出的命令, 占位符的下标)
+        self._cmd_cache: Optional[Tuple[ffmpeg.Stream, tuple, List[str], int]] = None
+        self._rng = _rng if rng is None else rng
+        # 构建滤镜图时实际使用的硬件加速方式，生成命令时据此初始化硬件设备，之后再修改 ACCEL 也不会不一致
+        self._accel: Optional[str] = None
 
-    def generate_cmd(self, output: FileDesc, quiet: bool = True, y: bool = True, accurate_seek: bool = False, other_args: List[str] = []) -> List[str]:
+    def generate_cmd(self, output: FileDesc, quiet: bool = True, y: bool = True, accurate_seek: bool = False, threads: Optional[int] = None, other_args: List[str] = [], stats: bool = False, filter_threads: Optional[int] = None, audio: bool = True) -> List[str]:
         """
         生成变换用的命令
 
@@ -72,55 +593,247 @@ class Transform(object):
         :param quiet: 静默模式，对应 ffmpeg 的 -v quiet
         :param y: 不进行确认，对应 ffmpeg 的 -y
         :param accurate_seek: 精准时间切割，对应 ffmpeg 的 -accurate_seek -avoid_negative_ts 1
+        :param threads: 编码使用的线程数，对应 ffmpeg 的 -threads，不传入时由 ffmpeg 自行决定
         :param other_args: 其它 ffmpeg 的参数
+        :param stats: 是否输出编码进度，不输出时对应 ffmpeg 的 -nostats
+        :param filter_threads: 滤镜图使用的线程数，对应 ffmpeg 的 -filter_complex_threads，不传入时由 ffmpeg 自行决定
+        :param audio: 是否保留输入的音频，输出格式与输入相同时直接复制而不重新编码，没有添加任何滤镜时视频也直接复制；输出为图片或 GIF 时总是不包含音频
         :returns: 变换用的命令
         :raises AssertionError
         """
+        if not isinstance(output, str):
+            return Transform.generate_batch_cmd([self], [output], quiet, y, accurate_seek, threads, other_args, stats, filter_threads, audio)
 
-        global_args = []
-        if self.now_duration is not None:
-            self.input.update({
-                'ss': str(self.now_duration[0]),
-                't': str(self.now_duration[1]),
-            })
-            if accurate_seek:
-                self.input.update({
-                    'accurate_seek': None,
-                    'avoid_negative_ts': '1',
-                })
+        self.__resolve_duration()
+        # 滤镜图与参数都没有变化时直接替换输出路径，不再重新遍历滤镜图
+        # 每次修改滤镜图都会生成新的 stream 对象，因此按对象身份比较即可，不需要计算哈希
+        # 是否直接复制视频取决于输出格式，因此占位符保留输出的扩展名
+        placeholder = _OUTPUT_PLACEHOLDER + os.path.splitext(output)[1]
+        # 使用的硬件加速方式由滤镜图决定，不需要放在 key 中
+        key = (self.now_duration, quiet, y, accurate_seek, threads, tuple(other_args), stats, filter_threads, audio, placeholder)
+        cache = self._cmd_cache
+        if cache is None or cache[0] is not self.stream or cache[1] != key:
+            template = Transform.generate_batch_cmd(
+                [self], [placeholder], quiet, y, accurate_seek, threads, other_args, stats, filter_threads, audio)
+            cache = self._cmd_cache = (
+                self.stream, key, template, template.index(placeholder))
+        cmd = list(cache[2])
+        cmd[cache[3]] = output
+        return cmd
+
+    def run(self, output: FileDesc, **kwargs) -> subprocess.CompletedProcess[bytes]:
+        """
+        执行变换
+
+        :param output: 输出文件
+        :param **kwargs: 其它 param 参考 generate_cmd()
+        :returns: CompletedProcess 对象
+        :raises AssertionError
+        :raises CalledProcessError
+        """
+        return Transform.__wait(self.run_async(output, **kwargs))
+
+    def run_async(self, output: FileDesc, **kwargs) -> subprocess.Popen[bytes]:
+        """
+        启动变换但不等待其完成，便于同时执行多个变换
+
+        :param output: 输出文件
+        :param **kwargs: 其它 param 参考 generate_cmd()
+        :returns: ffmpeg 进程的 Popen 对象
+        :raises AssertionError
+        """
+        return Transform.__popen(self.generate_cmd(output, **kwargs), kwargs.get('quiet', True))
+
+    @staticmethod
+    def generate_batch_cmd(transforms: Sequence[Transform], outputs: Sequence[FileDesc], quiet: bool = True, y: bool = True, accurate_seek: bool = False, threads: Optional[int] = None, other_args: List[str] = [], stats: bool = False, filter_threads: Optional[int] = None, audio: bool = True) -> List[str]:
+        """
+        生成在同一个 ffmpeg 进程中执行多个变换的命令，以分摊 ffmpeg 的启动开销
+
+        :param transforms: 要执行的变换
+        :param outputs: 各变换对应的输出文件
+        :param **kwargs: 其它 param 参考 generate_cmd()，其中 threads 对每个输出分别生效
+        :returns: 变换用的命令
+        :raises AssertionError
+        """
+        assert len(transforms) == len(outputs), 'should have exactly 1 output per transform'
+        assert len(transforms) > 0, 'should have at least 1 transform'
+
+        # 不输出版本信息与编码进度，减少每个 ffmpeg 进程的输出
+        global_args = ['-hide_banner']
+        if not stats:
+            global_args.append('-nostats')
         if quiet:
             global_args += ['-v', 'quiet']
+        if filter_threads is not None:
+            # 同一进程中的所有输出共用一个滤镜图，因此是全局参数
+            global_args += ['-filter_complex_threads', str(filter_threads)]
+        streams = []
+        for transform, output in zip(transforms, outputs):
+            transform.__seek(accurate_seek)
+            stream = transform.stream
+            unfiltered = stream is transform._source
+            # 有多个输出时，没有显式映射的输出会由 ffmpeg 从所有输入中选取流，因此未添加滤镜时也要映射本输入的流
+            mapping = unfiltered and len(transforms) > 1
+            mapped = [stream['v'] if mapping else stream]
+            extra_args: Dict[str, Optional[str]] = {}
+            if threads is not None:
+                extra_args['threads'] = str(threads)
+            parameters = _file_parameters(output)
+            filename = parameters['filename']
+            # 只有输出格式与输入相同时才能保证容器支持输入的音频编码，否则由 ffmpeg 选择音频编码器
+            same_format = _same_format(transform.input['filename'], filename)
+            if not audio:
+                extra_args['an'] = None
+            elif not _has_audio(filename):
+                # 图片与 GIF 不能包含音频，不映射音频流，未添加滤镜时 ffmpeg 也不会为其选取音频
+                pass
+            elif unfiltered:
+                # 没有任何滤镜时 ffmpeg 默认会选取音频，输出格式相同且不需要精确切割时连视频也不必重新编码
+                if mapping:
+                    mapped.append(transform._source['a?'])
+                if same_format and not accurate_seek:
+                    extra_args['c'] = 'copy'
+                elif same_format:
+                    extra_args['acodec'] = 'copy'
+            else:
+                # 使用滤镜图时只会输出显式映射的流，输入没有音频时 ? 使其被忽略
+                mapped.append(transform._source['a?'])
+                if same_format:
+                    extra_args['acodec'] = 'copy'
+            # 输出参数中显式指定的选项优先
+            streams.append(ffmpeg.output(
+                *mapped,
+                **{**extra_args, **parameters},
+            ))
+        # 滤镜图都已构建，按实际使用的硬件加速方式初始化设备，而不是按当前的 ACCEL
+        accels = {transform._accel for transform in transforms} - {None}
+        assert len(accels) <= 1, 'should not mix different hardware accelerations in 1 process'
+        for accel in accels:
+            global_args += ['-init_hw_device', f'{accel}=hw', '-filter_hw_device', 'hw']
         global_args += other_args
-        stream = ffmpeg.output(
-            self.stream,
-            **self.__get_file_parameters(output),
-        )
-        if global_args:
-            stream = ffmpeg.nodes.GlobalNode(
-                stream,
-                'my_args',
-                global_args
-            ).stream()
+        stream = streams[0] if len(streams) == 1 else ffmpeg.merge_outputs(*streams)
+        stream = ffmpeg.nodes.GlobalNode(
+            stream,
+            'my_args',
+            global_args
+        ).stream()
 
         return ffmpeg.compile(stream, overwrite_output=y)
 
-    def run(self, output: FileDesc, **kwargs) -> subprocess.CompletedProcess[bytes]:
+    @staticmethod
+    def batch(transforms: Sequence[Transform], outputs: Sequence[FileDesc], **kwargs) -> subprocess.CompletedProcess[bytes]:
         """
-        执行变换
+        在同一个 ffmpeg 进程中执行多个变换，注意参数完全相同的水印会被 ffmpeg-python 合并为同一个节点而无法生成命令，此时应使用 shared_watermark()
 
-        :param output: 输出文件
-        :param **kwargs: 其它 param 参考 generate_cmd()
+        :param transforms: 要执行的变换
+        :param outputs: 各变换对应的输出文件
+        :param **kwargs: 其它 param 参考 generate_batch_cmd()
         :returns: CompletedProcess 对象
         :raises AssertionError
+        :raises CalledProcessError
+        """
+        return Transform.__wait(Transform.__popen(Transform.generate_batch_cmd(transforms, outputs, **kwargs), kwargs.get('quiet', True)))
+
+    @staticmethod
+    def run_batch(jobs: Sequence[Tuple[Transform, FileDesc]], max_workers: Optional[int] = None, group_size: int = 1, **kwargs) -> List[subprocess.CompletedProcess[bytes]]:
+        """
+        同时运行多个 ffmpeg 进程分别执行各个变换，适合大量小文件、单个 ffmpeg 进程无法用满 CPU 的情况
+
+        :param jobs: 要执行的变换及其输出文件
+        :param max_workers: 同时运行的 ffmpeg 进程数，默认为 CPU 核心数的一半
+        :param group_size: 每个 ffmpeg 进程最多执行几个滤镜图结构相同的变换，大于 1 时可以分摊短视频的 ffmpeg 启动开销，带水印的变换总是单独执行，同一输入文件的变换不会放在同一进程中
+        :param **kwargs: 其它 param 参考 generate_cmd()，不传入 threads 与 filter_threads 时各进程平分 CPU 核心，同一进程中的各输出再平分 threads
+        :returns: 各变换对应的 CompletedProcess 对象
+        :raises AssertionError
+        :raises CalledProcessError
+        """
+        cpu_count = os.cpu_count() or 1
+        if max_workers is None:
+            max_workers = max(1, cpu_count // 2)
+        assert max_workers > 0, 'should run at least 1 job at the same time'
+        # 避免多个 ffmpeg 进程各自开满线程互相争抢
+        for name in ('threads', 'filter_threads'):
+            if kwargs.get(name) is None:
+                kwargs[name] = max(1, cpu_count // max_workers)
+        assert group_size > 0, 'should have at least 1 transform per process'
+        # 每组为同一个 ffmpeg 进程中执行的变换在 jobs 中的下标
+        groups: List[List[int]] = []
+        # (硬件加速方式, 滤镜图结构) -> 尚未装满的组
+        pending: Dict[tuple, List[int]] = {}
+        for index, (transform, _) in enumerate(jobs):
+            skeleton = None if group_size == 1 else _skeleton(transform.stream)
+            if skeleton is None:
+                groups.append([index])
+                continue
+            key = (transform._accel, skeleton)
+            group = pending.get(key)
+            filename = transform.input['filename']
+            # 同一输入文件的输入节点会被 ffmpeg-python 合并为一个 -i，只有一个变换的剪切能生效，因此另起一组
+            if group is None or any(jobs[other][0].input['filename'] == filename for other in group):
+                group = pending[key] = []
+                groups.append(group)
+            group.append(index)
+            if len(group) == group_size:
+                del pending[key]
+
+        def run_group(group: List[int]) -> subprocess.CompletedProcess[bytes]:
+            if len(group) == 1:
+                transform, output = jobs[group[0]]
+                return transform.run(output, **kwargs)
+            # 编码线程由同一进程中的各输出平分，滤镜图只有一个，使用全部线程
+            return Transform.batch([jobs[index][0] for index in group], [jobs[index][1] for index in group],
+                                   **dict(kwargs, threads=max(1, kwargs['threads'] // len(group))))
+
+        # 实际的工作都在 ffmpeg 子进程中，线程只负责生成命令并等待，不需要进程池
+        results: List[Optional[subprocess.CompletedProcess[bytes]]] = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for group, result in zip(groups, executor.map(run_group, groups)):
+                # 同一进程中的变换共用一个 CompletedProcess
+                for index in group:
+                    results[index] = result
+        return results
+
+    @staticmethod
+    def shared_watermark(image: FileDesc, count: int, alpha: float = 1.0, scale: float = 1.0, angle: float = 0.0) -> List[ffmpeg.Stream]:
+        """
+        只读取并处理一次水印图像，再通过 split 滤镜复制给同一个 ffmpeg 进程中的多个变换使用
+
+        :param image: 水印/字幕图像
+        :param count: 需要的水印流数量
+        :param alpha: 透明度
+        :param scale: 缩放
+        :param angle: 顺时针旋转角度，角度制
+        :returns: 处理好的水印流，可以作为 watermark() 的 image 参数
+        """
+        stream = _watermark(image, alpha, scale, angle)
+        if count == 1:
+            return [stream]
+        split = ffmpeg.filter_multi_output(stream, 'split')
+        return [split.stream(i) for i in range(count)]
+
+    @staticmethod
+    def batch_watermark(inputs: Sequence[FileDesc], outputs: Sequence[FileDesc], image: FileDesc, alpha: float = 1.0, x: Expression = 0, y: Expression = 0, scale: float = 1.0, angle: float = 0.0, **kwargs) -> subprocess.CompletedProcess[bytes]:
         """
-        return subprocess.run(self.generate_cmd(output, **kwargs), check=True, stderr=subprocess.STDOUT)
+        在同一个 ffmpeg 进程中为多个视频/图片添加相同的水印/字幕，水印图像只会被读取并处理一次
+
+        :param inputs: 要处理的视频/图片
+        :param outputs: 各输入对应的输出文件
+        :param **kwargs: 其它 param 参考 watermark() 与 batch()
+        :returns: CompletedProcess 对象
+        :raises AssertionError
+        :raises CalledProcessError
+        """
+        streams = Transform.shared_watermark(image, len(inputs), alpha, scale, angle)
+        return Transform.batch([
+            Transform(input).watermark(stream, x=x, y=y) for input, stream in zip(inputs, streams)
+        ], outputs, **kwargs)
 
     # 水印/字幕：水印/字幕图像，透明度，位置，大小，角度
-    def watermark(self, image: FileDesc, alpha: float = 1.0, x: Expression = 0, y: Expression = 0, scale: float = 1.0, angle: float = 0.0):
+    def watermark(self, image: Union[FileDesc, ffmpeg.Stream], alpha: float = 1.0, x: Expression = 0, y: Expression = 0, scale: float = 1.0, angle: float = 0.0):
         """
         为视频/图片添加水印/字幕
 
-        :param image: 水印/字幕图像
+        :param image: 水印/字幕图像，也可以是 shared_watermark() 返回的已处理好的水印流，此时 alpha、scale、angle 不再生效
         :param alpha: 透明度
         :param x: 水平轴上的起始位置
         :param y: 竖直轴上的起始位置
@@ -128,12 +841,9 @@ class Transform(object):
         :param angle: 顺时针旋转角度，角度制
         :returns: self
         """
-        self.stream = ffmpeg.overlay(
-            self.stream,
-            Transform(image).scale(scale).rotate(angle).alpha(alpha).stream,
-            x=x,
-            y=y,
-        )
+        # 完全透明的水印不改变画面，shared_watermark() 复制出的水印流必须被使用，不能跳过
+        if alpha != 0.0 or isinstance(image, ffmpeg.Stream):
+            self._ops.append(('overlay', (image, alpha, x, y, scale, angle), {}))
         return self
 
     # 加边框：边框比例、位置
@@ -147,20 +857,14 @@ class Transform(object):
         :param left: 左方边框宽度
         :returns: self
         """
-        # http://trac.ffmpeg.org/ticket/1618
-        self.filter(
-            'pad',
-            'ceil((iw+x+{})/2)*2'.format(right),
-            'ceil((ih+y+{})/2)*2'.format(bottom),
-            'round({})'.format(left),
-            'round({})'.format(top),
-        )
+        if top != 0 or right != 0 or bottom != 0 or left != 0:
+            self._ops.append(('padding', (top, right, bottom, left), {}))
         return self
 
     # 更改长度：视频的保留比例
     def duration(self, start_ratio: float = 0.0, ratio: float = 1.0, duration=None):
         """
-        更改视频时长，注意 ffmpeg 无法精确 seek 到某一帧而只能 seek 到最近的关键帧。此外由于使用时长比例计算，导致该方法会调用 ffprobe 提取视频信息
+        更改视频时长，注意 ffmpeg 无法精确 seek 到某一帧而只能 seek 到最近的关键帧。此外由于使用时长比例计算，生成命令时会调用 ffprobe 提取视频信息（多次调用只获取一次），可以提前调用 probe_duration 进行缓存
 
         :param start_ratio: 视频开始的比例
         :param ratio: 视频的保留比例
@@ -169,11 +873,15 @@ class Transform(object):
         :raises AssertionError
         """
         assert start_ratio + ratio <= 1.0, 'should not longer than original video'
+        if start_ratio == 0.0 and ratio == 1.0:
+            return self
         if self.now_duration is None:
             if duration is None:
-                filename = self.input['filename']
-                duration = ffmpeg.probe(filename)['format']['duration']
-            self.now_duration = (0.0, float(duration))
+                # 只合并比例，不获取时长，被丢弃的变换不会调用 ffprobe
+                start, length = self._duration_ratios or (0.0, 1.0)
+                self._duration_ratios = (start + length * start_ratio, length * ratio)
+                return self
+            self.__resolve_duration(duration)
         start, end = self.now_duration
         length = end - start
         start += length * start_ratio
@@ -190,12 +898,7 @@ class Transform(object):
         :returns: self
         """
         if ratio != 1.0:
-            # 为什么只能是偶数？
-            self.filter(
-                'scale',
-                'round(iw*{}/2)*2'.format(ratio),
-                'round(ih*{}/2)*2'.format(ratio),
-            )
+            self._ops.append(('scale', (ratio,), {}))
         return self
 
     # 镜像
@@ -208,6 +911,15 @@ class Transform(object):
         self.filter('hflip')
         return self
 
+    def flip(self):
+        """
+        竖直镜像视频/图片
+
+        :returns: self
+        """
+        self.filter('vflip')
+        return self
+
     # 旋转：旋转角度
     def rotate(self, angle: float = 0.0):
         """
@@ -217,24 +929,8 @@ class Transform(object):
         :returns: self
         """
         angle %= 360
-        if angle == 90:
-            self.filter('transpose', '1')
-        elif angle == 180:
-            self.filter('transpose', '1').filter('transpose', '1')
-        elif angle == 270:
-            self.filter('transpose', '2')
-        elif angle != 0:
-            radian = math.radians(angle)
-            abssin = abs(math.sin(radian))
-            abscos = abs(math.cos(radian))
-            radian = '{}*PI/180'.format(angle)
-            self.filter(
-                'rotate',
-                radian,
-                'iw*{}+ih*{}'.format(abscos, abssin),
-                'iw*{}+ih*{}'.format(abssin, abscos),
-                fillcolor='none',
-            )
+        if angle != 0:
+            self._ops.append(('rotate', (angle,), {}))
         return self
 
     # 亮度：明暗度数
@@ -245,7 +941,8 @@ class Transform(object):
         :param brightness: 亮度
         :returns: self
         """
-        self.filter('eq', brightness=brightness)
+        if brightness != 0.0:
+            self.filter('eq', brightness=brightness)
         return self
 
     # 剪切：剪切位置、比例
@@ -259,13 +956,14 @@ class Transform(object):
         :param y: 裁剪竖直起始位置
         :returns: self
         """
-        self.filter(
-            'crop',
-            w=w,
-            h=h,
-            x=x,
-            y=y,
-        )
+        if w != 'iw' or h != 'ih' or x != 0 or y != 0:
+            self.filter(
+                'crop',
+                w=w,
+                h=h,
+                x=x,
+                y=y,
+            )
         return self
 
     def alpha(self, alpha: float = 1.0):
@@ -275,13 +973,37 @@ class Transform(object):
         :param alpha: 透明度
         :returns: self
         """
-        self.filter('format', 'rgba').filter('colorchannelmixer', aa=alpha)
+        if alpha != 1.0:
+            self._ops.append(('alpha', (alpha,), {}))
         return self
 
     def filter(self, *args, **kwargs):
-        self.stream = ffmpeg.filter(self.stream, *args, **kwargs)
+        self._ops.append(('filter', args, kwargs))
         return self
 
+    @property
+    def stream(self) -> ffmpeg.Stream:
+        # 合并相邻的操作后按顺序构建滤镜图，构建后的结果会被保留，之后的操作接在其后
+        if self._ops:
+            stream = self._stream
+            accel = self.ACCEL
+            for name, args, kwargs in _simplify(self._ops):
+                if accel is not None and name == 'scale':
+                    assert self._accel in (None, accel), 'should not mix different hardware accelerations in 1 transform'
+                    stream = _hw_scale(stream, accel, *args, **kwargs)
+                    self._accel = accel
+                else:
+                    stream = _EMITTERS[name](stream, *args, **kwargs)
+            self._stream = stream
+            self._ops = []
+        return self._stream
+
+    @stream.setter
+    def stream(self, stream: ffmpeg.Stream):
+        # 直接替换整个滤镜图，尚未构建的操作一并丢弃
+        self._stream = stream
+        self._ops = []
+
     methods: Sequence[MethodName] = (
         'watermark',
         'padding',
@@ -301,7 +1023,7 @@ class Transform(object):
         k: Optional[Chooseable[int]] = None,
     ):
         """
-        将前八种变换方式随机混合
+        将前八种变换方式随机混合，选出的变换按 brightness、mirror、crop、scale、rotate、padding、watermark、duration 的顺序应用
 
         :param args: 传入各函数的参数或参数取值的可选列表，以 watermark 方法为例：
             固定单组参数：
@@ -342,38 +1064,104 @@ class Transform(object):
                     }
                 ], weights=[2, 3])[0]
             }
+            也可以传入 compile_arguments() 预先解析好的参数，对大量输入使用同一组参数时可以减少开销
         :param methods: 要使用的变换列表，默认为全部八种变换
         :param k: 对每个应用几种变换
         :returns: self
         """
+        rng = self._rng
         if k is None:
-            def random_k(): return random.randint(1, len(methods))
+            def random_k(): return rng.randint(1, len(methods))
             k = random_k
-        for method in random.sample(methods, k=choice(k)):
-            kwargs = {
-                name: choice(argument) for name, argument in choice(args.get(method, {})).items()
-            }
-            getattr(self, method)(**kwargs)
+        # 随机选取变换后按固定顺序应用，不在 _MIXED_ORDER 中的变换放在最后
+        sampled = sorted(rng.sample(methods, k=choice(k, rng)),
+                         key=lambda method: _MIXED_PRIORITY.get(method, len(_MIXED_ORDER)))
+        compiled = isinstance(args, CompiledArguments)
+        # 类级别的方法表在循环外取出一次，循环内只剩一次字典查找
+        method_fn = self._METHOD_FN
+        for method in sampled:
+            if compiled:
+                kwargs = args[method](rng) if method in args else {}
+            else:
+                kwargs = {
+                    name: choice(argument, rng) for name, argument in choice(args.get(method, {}), rng).items()
+                }
+            fn = method_fn.get(method) or getattr(type(self), method)
+            fn(self, **kwargs)
         return self
 
     # 以下为内部方法，不做调用方法注释，也不应被手动调用
 
-    @staticmethod
-    def __get_file_parameters(file: FileDesc) -> FileParameters:
-        return file if isinstance(file, dict) else {
-            'filename': file,
+    # 各变换方法对应的函数，避免每次调用都要沿 MRO 查找
+    _METHOD_FN: Dict[MethodName, Callable[..., Transform]]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._METHOD_FN = {
+            method: getattr(cls, method) for method in cls.methods
         }
 
-    def __input(self, input: FileDesc) -> ffmpeg.Stream:
-        return ffmpeg.input(**self.__get_file_parameters(input))
+    @staticmethod
+    def __popen(cmd: List[str], quiet: bool) -> subprocess.Popen[bytes]:
+        # 静默模式下 ffmpeg 不会输出有用的信息，直接丢弃而不是占用管道
+        # ffmpeg 默认会读取标准输入中的交互按键，关闭后不会因终端输入而暂停或退出
+        return subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL if quiet else None,
+            stderr=subprocess.DEVNULL if quiet else subprocess.STDOUT,
+        )
+
+    @staticmethod
+    def __wait(process: subprocess.Popen[bytes]) -> subprocess.CompletedProcess[bytes]:
+        returncode = process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, process.args)
+        return subprocess.CompletedProcess(process.args, returncode)
+
+    def __resolve_duration(self, duration: Optional[float] = None):
+        if self.now_duration is not None or (self._duration_ratios is None and duration is None):
+            return
+        if duration is None:
+            duration = probe_duration(self.input['filename'])
+        start_ratio, ratio = self._duration_ratios or (0.0, 1.0)
+        self.now_duration = (duration * start_ratio, duration * (start_ratio + ratio))
+        self._duration_ratios = None
+
+    def __seek(self, accurate_seek: bool):
+        self.__resolve_duration()
+        if self.now_duration is not None:
+            self.input.update({
+                'ss': str(self.now_duration[0]),
+                't': str(self.now_duration[1] - self.now_duration[0]),
+            })
+            if accurate_seek:
+                self.input.update({
+                    'accurate_seek': None,
+                    'avoid_negative_ts': '1',
+                })
+
+
+Transform._METHOD_FN = {
+    method: getattr(Transform, method) for method in Transform.methods
+}
+
+# 各变换方法的形参名（不含 self），在导入时一次性反射得到
+_METHOD_PARAMS: Dict[MethodName, Tuple[ArgumentName, ...]] = {
+    method: tuple(
+        name for name in inspect.signature(getattr(Transform, method)).parameters if name != 'self'
+    ) for method in Transform.methods
+}
+
+
+# RandomizedTransform.rotate 随机选取的角度，以 2 个随机位作为下标，比 randint 少了范围计算与拒绝采样
+_RANDOM_ANGLES = (0.0, 90.0, 180.0, 270.0)
 
 
 # 默认参数为随机的 Transform 类
 # 用户也可以通过像这样继承 Transform 类来对方法进行扩展从而达到更高的自由度，比如增加一种变换方式
+# 除 rotate 有 1/4 的概率不旋转外，随机参数几乎不会恰好等于恒等变换，因此不会被跳过
 class RandomizedTransform(Transform):
-    def __super(self):
-        return super(RandomizedTransform, self)
-
     def watermark(
         self,
         image: str,
@@ -384,16 +1172,16 @@ class RandomizedTransform(Transform):
         angle: Optional[float] = None,
     ):
         if alpha is None:
-            alpha = 0.3 + random.random() * 0.7
+            alpha = 0.3 + self._rng.random() * 0.7
         if x is None:
-            x = '{}*(W-w)'.format(random.random())
+            x = f'{self._rng.random()}*(W-w)'
         if y is None:
-            y = '{}*(H-h)'.format(random.random())
+            y = f'{self._rng.random()}*(H-h)'
         if scale is None:
-            scale = random.random() * 2
+            scale = self._rng.random() * 2
         if angle is None:
-            angle = random.random() * 360
-        self.__super().watermark(image, alpha, x, y, scale, angle)
+            angle = self._rng.random() * 360
+        super().watermark(image, alpha, x, y, scale, angle)
         return self
 
     def padding(
@@ -404,14 +1192,14 @@ class RandomizedTransform(Transform):
         left: Optional[Expression] = None,
     ):
         if top is None:
-            top = '{}*ih'.format(random.random() * 0.25)
+            top = f'{self._rng.random() * 0.25}*ih'
         if right is None:
-            right = '{}*iw'.format(random.random() * 0.25)
+            right = f'{self._rng.random() * 0.25}*iw'
         if bottom is None:
-            bottom = '{}*ih'.format(random.random() * 0.25)
+            bottom = f'{self._rng.random() * 0.25}*ih'
         if left is None:
-            left = '{}*iw'.format(random.random() * 0.25)
-        self.__super().padding(top, right, bottom, left)
+            left = f'{self._rng.random() * 0.25}*iw'
+        super().padding(top, right, bottom, left)
         return self
 
     def duration(
@@ -420,10 +1208,10 @@ class RandomizedTransform(Transform):
         ratio: Optional[float] = None,
     ):
         if start_ratio is None:
-            start_ratio = random.random() * 0.1 * (1.0 - (ratio or 0.0))
+            start_ratio = self._rng.random() * 0.1 * (1.0 - (ratio or 0.0))
         if ratio is None:
-            ratio = (0.9 + random.random() * 0.1) * (1.0 - start_ratio)
-        self.__super().duration(start_ratio, ratio)
+            ratio = (0.9 + self._rng.random() * 0.1) * (1.0 - start_ratio)
+        super().duration(start_ratio, ratio)
         return self
 
     def scale(
@@ -431,8 +1219,8 @@ class RandomizedTransform(Transform):
         ratio: Optional[float] = None,
     ):
         if ratio is None:
-            ratio = 0.4 + random.random() * 0.8
-        self.__super().scale(ratio)
+            ratio = 0.4 + self._rng.random() * 0.8
+        super().scale(ratio)
         return self
 
     def rotate(
@@ -440,8 +1228,8 @@ class RandomizedTransform(Transform):
         angle: Optional[float] = None,
     ):
         if angle is None:
-            angle = random.randint(0, 3) * 90.0
-        self.__super().rotate(angle)
+            angle = _RANDOM_ANGLES[self._rng.getrandbits(2)]
+        super().rotate(angle)
         return self
 
     def brightness(
@@ -449,8 +1237,8 @@ class RandomizedTransform(Transform):
         brightness: Optional[float] = None,
     ):
         if brightness is None:
-            brightness = 0.4 * random.random() - 0.2
-        self.__super().brightness(brightness)
+            brightness = 0.4 * self._rng.random() - 0.2
+        super().brightness(brightness)
         return self
 
     def crop(
@@ -461,15 +1249,47 @@ class RandomizedTransform(Transform):
         y: Optional[Expression] = None,
     ):
         if w is None:
-            w = '{}*iw'.format(0.9 + random.random() * 0.1)
+            w = f'{0.9 + self._rng.random() * 0.1}*iw'
         if h is None:
-            h = '{}*ih'.format(0.9 + random.random() * 0.1)
+            h = f'{0.9 + self._rng.random() * 0.1}*ih'
         if x is None:
-            x = '{}*(iw-ow)'.format(random.random(), w)
+            x = f'{self._rng.random()}*(iw-ow)'
         if y is None:
-            y = '{}*(ih-oh)'.format(random.random(), h)
-        self.__super().crop(w, h, x, y)
+            y = f'{self._rng.random()}*(ih-oh)'
+        super().crop(w, h, x, y)
         return self
 
 
-__all__ = ('Transform', 'RandomizedTransform')
+# 参数完全相同的一批变换，滤镜图只构建一次，之后只替换命令中的输入/输出路径
+class BatchTransform(object):
+    __slots__ = ['template', 'inputs', 'outputs']
+
+    def __init__(self, generate_cmd: Callable[[Sequence[FilePath], Sequence[FilePath]], List[str]], count: int = 1, input_extension: str = '', output_extension: str = ''):
+        """
+        以占位路径构建命令模板
+
+        :param generate_cmd: 由输入与输出生成命令的函数，只会以占位路径调用一次，因此不能依赖输入文件本身（如 duration 需要获取视频时长）
+        :param count: 每条命令处理的输入数
+        :param input_extension: 输入文件的扩展名（如 '.mp4'），占位路径保留扩展名，生成命令时才能判断能否直接复制音视频
+        :param output_extension: 输出文件的扩展名，同上
+        """
+        self.inputs = [f'__TEMPLATE_INPUT_{i}__{input_extension}' for i in range(count)]
+        self.outputs = [f'__TEMPLATE_OUTPUT_{i}__{output_extension}' for i in range(count)]
+        self.template = generate_cmd(self.inputs, self.outputs)
+
+    def generate_cmd(self, inputs: Sequence[FilePath], outputs: Sequence[FilePath]) -> List[str]:
+        """
+        将模板中的占位路径替换为实际路径
+
+        :param inputs: 输入文件
+        :param outputs: 各输入对应的输出文件
+        :returns: 变换用的命令
+        :raises AssertionError
+        """
+        assert len(inputs) == len(self.inputs) and len(outputs) == len(self.outputs), 'should have the same amount of inputs and outputs as the template'
+        paths = dict(zip(self.inputs, inputs))
+        paths.update(zip(self.outputs, outputs))
+        return [paths.get(arg, arg) for arg in self.template]
+
+
+__all__ = ('Transform', 'RandomizedTransform', 'BatchTransform', 'CompiledArguments', 'cache_durations', 'compile_arguments', 'probe', 'probe_duration', 'seed')